@@ -0,0 +1,70 @@
+"""
+Send signed test webhook deliveries to the deployed service.
+
+Usage:
+    GITHUB_WEBHOOK_SECRET=... python scripts/send_webhook.py [count]
+
+WEBHOOK_URL overrides the target (defaults to the public gateway route).
+WEBHOOK_TEST_ALGO=blake2 signs with keyed BLAKE2b instead of HMAC-SHA256, which is
+cheaper on CPUs without SHA extensions; only a service running with APP_ENVIRONMENT=local
+accepts it. Never use it against production.
+"""
+import asyncio
+import hashlib
+import hmac
+import os
+import sys
+import uuid
+
+import httpx
+import orjson
+
+URL = os.getenv("WEBHOOK_URL", "https://jpgcp.shop/webhook/webhook")
+SECRET = os.getenv("GITHUB_WEBHOOK_SECRET", "")
+SIG_ALGO = os.getenv("WEBHOOK_TEST_ALGO", "sha256")
+
+# Keyed HMAC state (key padding already absorbed); copied per payload instead of re-keyed
+_MAC_TEMPLATE = hmac.new(SECRET.encode("utf-8"), b"", hashlib.sha256)
+
+payload = {"zen": "Keep it logically awesome.", "hook_id": 0}
+
+
+def sign(body: bytes) -> str:
+    mac = _MAC_TEMPLATE.copy()
+    mac.update(body)
+    return mac.hexdigest()
+
+
+def signature_headers(body: bytes) -> dict:
+    if SIG_ALGO == "blake2":
+        return {"X-Hub-Signature-Blake2": hashlib.blake2b(body, key=SECRET.encode("utf-8"), digest_size=32).hexdigest()}
+    return {"X-Hub-Signature-256": f"sha256={sign(body)}"}
+
+
+# The payload never changes, so serialize, sign and build the headers once
+BODY = orjson.dumps(payload)
+HEADERS = {
+    "Content-Type": "application/json",
+    "X-GitHub-Event": "ping",
+    **signature_headers(BODY),
+}
+
+
+async def send_one(client: httpx.AsyncClient) -> httpx.Response:
+    """
+    Post the prebuilt payload once; only the delivery id changes per call,
+    otherwise the service drops repeats as duplicates.
+    """
+    return await client.post(URL, content=BODY, headers={"X-GitHub-Delivery": str(uuid.uuid4())})
+
+
+async def main(count: int = 1):
+    # One HTTP/2 client: against the TLS gateway all posts are multiplexed over a single connection
+    async with httpx.AsyncClient(http2=True, headers=HEADERS, timeout=10) as client:
+        responses = await asyncio.gather(*(send_one(client) for _ in range(count)))
+    for i, resp in enumerate(responses):
+        print(f"[{i}] {resp.http_version} {resp.status_code} {resp.text}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 1))
@@ -1,18 +1,73 @@
+import asyncio
+import hashlib
+import hmac
 import os
+from contextlib import asynccontextmanager
 
 import aiohttp
-from gidgethub.aiohttp import GitHubAPI
+import httpx
+import orjson
+from arq import create_pool
+from arq.connections import RedisSettings
+from redis.asyncio import Redis
+from cryptography.hazmat.primitives.serialization import load_pem_private_key
 from src.services.code_review_service import CodeReviewService
-from src.services.gh_service import GithubService
+from src.services.gh_service import GITHUB_MAX_CONCURRENCY, GithubService, ThrottledGitHubAPI
 import src.configs.config
+from src.configs.config import yaml_configs
 
 from fastapi import FastAPI, Request, HTTPException, BackgroundTasks, Response
+from fastapi.responses import ORJSONResponse
+from starlette.datastructures import Headers
 from starlette.middleware.base import BaseHTTPMiddleware
 from loguru import logger
 from gidgethub import routing, sansio
-from src.services.gh_service import create_installation_access_token
+from src.services.gh_service import create_installation_access_token, invalidate_installation_token
 
-app = FastAPI(root_path="/webhook")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 整个应用生命周期内共享一个 ClientSession, 复用 TCP/TLS 连接池
+    app.state.http_session = aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(limit=100, limit_per_host=16, ttl_dns_cache=300, keepalive_timeout=75)
+    )
+    logger.info("Shared aiohttp ClientSession created.")
+    # GitHub API 调用走 HTTP/2, 同一事件的多个请求复用一条连接
+    # httpx 默认 5 s 超时对评论等较慢的 GitHub 调用太短: 连接 10 s, 读写 60 s
+    app.state.gh_client = httpx.AsyncClient(
+        http2=True,
+        limits=httpx.Limits(max_connections=100, max_keepalive_connections=20),
+        timeout=httpx.Timeout(60.0, connect=10.0),
+    )
+
+    # 所有事件共享的并发上限, 避免触发 GitHub secondary rate limit
+    app.state.gh_sem = asyncio.Semaphore(GITHUB_MAX_CONCURRENCY)
+
+    def gh_service_factory(token: str, refresh_token=None) -> GithubService:
+        # 每个事件只需要新的 token, 底层连接池始终是共享的 client
+        gh = ThrottledGitHubAPI(
+            app.state.gh_client, "py-webhook-svc", oauth_token=token, base_url=GITHUB_API_BASE_URL,
+            semaphore=app.state.gh_sem, refresh_token=refresh_token
+        )
+        return GithubService(gh)
+
+    app.state.gh_service_factory = gh_service_factory
+    # 配置了 ARQ_REDIS_URL 时, webhook 事件交给独立的 arq worker 处理
+    app.state.arq_pool = await create_pool(RedisSettings.from_dsn(ARQ_REDIS_URL)) if ARQ_REDIS_URL else None
+    app.state.redis = Redis.from_url(REDIS_URL) if REDIS_URL else None
+    try:
+        yield
+    finally:
+        if app.state.redis is not None:
+            await app.state.redis.aclose()
+        if app.state.arq_pool is not None:
+            await app.state.arq_pool.aclose()
+        await app.state.gh_client.aclose()
+        await app.state.http_session.close()
+        logger.info("Shared aiohttp ClientSession closed.")
+
+
+app = FastAPI(root_path="/webhook", default_response_class=ORJSONResponse, lifespan=lifespan)
 router = routing.Router()
 
 # 读取 GitHub App 配置
@@ -21,12 +76,22 @@ app_id_str = os.getenv("GITHUB_APP_ID")
 APP_ID = int(float(app_id_str)) if app_id_str else None
 PRIVATE_KEY_PATH = os.getenv("GITHUB_PRIVATE_KEY_PATH")
 GITHUB_API_BASE_URL = os.getenv("GITHUB_API_BASE_URL", "https://api.github.com")
+ARQ_REDIS_URL = os.getenv("ARQ_REDIS_URL")
+REDIS_URL = os.getenv("REDIS_URL")
+# GitHub 超时重投同一个 X-GitHub-Delivery, 在这段时间内只处理一次
+DELIVERY_DEDUPE_TTL = 3600
+# 新开 PR 时自动添加的 labels 和 reviewers
+PR_OPENED_LABELS = yaml_configs.get("pull_request", {}).get("labels") or []
+PR_OPENED_REVIEWERS = yaml_configs.get("pull_request", {}).get("reviewers") or []
+# 仅本地环境: 压测脚本可用 keyed BLAKE2b 签名 (X-Hub-Signature-Blake2) 代替 HMAC-SHA256
+ACCEPT_BLAKE2_SIGNATURE = os.getenv("APP_ENVIRONMENT", "dev") == "local"
 PRIVATE_KEY = None
 
 if PRIVATE_KEY_PATH:
     try:
-        with open(PRIVATE_KEY_PATH, "r") as f:
-            PRIVATE_KEY = f.read()
+        # 启动时解析一次 PEM, 之后签名 JWT 直接复用 key 对象
+        with open(PRIVATE_KEY_PATH, "rb") as f:
+            PRIVATE_KEY = load_pem_private_key(f.read(), password=None)
         logger.info("GitHub App Private Key successfully loaded from path.")
     except Exception as e:
         logger.error(f"无法读取 Private Key: {e}")
@@ -47,18 +112,17 @@ def read_item(item_id: int, q: str = None):
 def endpoint1(request: Request):
     client_ip = getattr(request, "client", None)
     client_ip = client_ip.host if client_ip else None
-    headers = dict(request.headers)
     return {
         "endpoint": "webhook/getcallinfo",
         "client_ip": client_ip,
-        "host": headers.get("host"),
+        "host": request.headers.get("host"),
         "method": request.method,
         "path": request.url.path,
         "query": request.url.query,
-        "headers": headers,
+        "headers": dict(request.headers),
     }
 
-def process_and_log_webhook(headers: dict, body: dict):
+def process_and_log_webhook(headers: Headers, body: dict):
     logger.info("--- Background webhook processing started ---")
     
     github_event = headers.get("x-github-event")
@@ -67,17 +131,19 @@ def process_and_log_webhook(headers: dict, body: dict):
     else:
         logger.info("X-GitHub-Event header not found.")
         
-    logger.info(f"Received full headers: {headers}")
-    logger.info(f"Received webhook payload: {body}")
+    # 大体积内容用 lazy 的 DEBUG 日志, sink 不接收时不会被格式化
+    logger.opt(lazy=True).debug("Received full headers: {}", lambda: headers)
+    logger.opt(lazy=True).debug("Received webhook payload: {}", lambda: body)
     logger.info("--- Background webhook processing finished ---")
 
 @app.post("/webhook-test")
 async def webhook_test(request: Request, background_tasks: BackgroundTasks, response: Response):
     logger.info("Webhook test endpoint called. Acknowledging request immediately.")
     
-    headers = dict(request.headers)
+    # Headers 是不可变的, 直接交给后台任务, 无需复制成 dict
+    headers = request.headers
     try:
-        body = await request.json()
+        body = orjson.loads(await request.body())
     except Exception as e:
         logger.warning(f"Could not parse request body as JSON: {e}")
         body = {"error": "Request body is not valid JSON."}
@@ -88,16 +154,16 @@ async def webhook_test(request: Request, background_tasks: BackgroundTasks, resp
     return {"status": "Accepted"}
 
 @router.register("issue_comment", action="created")
-async def issue_comment_event(event, gh, *args, **kwargs):
+async def issue_comment_event(event, gh_service: GithubService, *args, **kwargs):
     url = event.data["issue"]["comments_url"]
     author = event.data["comment"]["user"]["login"]
     message = f"Hello @{author}, thanks for the comment!"
-    await gh.post(url, data={"body": message})
+    await gh_service.gh.post(url, data={"body": message})
     print(f"Replied to {author}")
 
 
 @router.register("pull_request", action="opened")
-async def pull_request_opened_event(event, gh, *args, **kwargs):
+async def pull_request_opened_event(event, gh_service: GithubService, *args, **kwargs):
     pr_info = event.data["pull_request"]
     pr_number = pr_info["number"]
     pr_title = pr_info["title"]
@@ -111,46 +177,131 @@ async def pull_request_opened_event(event, gh, *args, **kwargs):
     logger.info(f"New Pull Request #{pr_number} opened by @{author} in {repo_owner}/{repo_name}: '{pr_title}' URL: {pr_url}")
     
     welcome_message = f"Thanks for opening this PR, @{author}! We will review it soon. You can view it here: {pr_url}"
-    
-    gh_service = GithubService(gh)
-    comment_result= await gh_service.post_general_pr_comment(owner=repo_owner, repo_name=repo_name, pr_number=pr_number, comment_body=welcome_message)
-    logger.info(f"Comment result: {comment_result}")
+
+    coros = [gh_service.post_general_pr_comment(owner=repo_owner, repo_name=repo_name, pr_number=pr_number, comment_body=welcome_message)]
+    if PR_OPENED_LABELS:
+        coros.append(gh_service.add_labels(owner=repo_owner, repo_name=repo_name, issue_number=pr_number, labels=PR_OPENED_LABELS))
+    # GitHub 不允许把作者自己设为 reviewer
+    reviewers = [r for r in PR_OPENED_REVIEWERS if r != author]
+    if reviewers:
+        coros.append(gh_service.request_reviewers(owner=repo_owner, repo_name=repo_name, pr_number=pr_number, reviewers=reviewers))
+
+    # 这些调用并发执行, 完成顺序不保证; 单个失败只记录日志, 不影响后续的 code review
+    results = await asyncio.gather(*coros, return_exceptions=True)
+    errors = [r for r in results if isinstance(r, BaseException)]
+    if errors:
+        logger.error(f"Some pull request follow-ups failed for #{pr_number}: {errors}")
+    logger.opt(lazy=True).debug("Pull request follow-up results: {}", lambda: results)
     logger.info("--- start code review process ---")
-    code_review_service = CodeReviewService(gs=gh_service)
-    review_result = await code_review_service.code_review(pr_url)
+    code_review_service = CodeReviewService(gs=gh_service, session=app.state.http_session)
+    review_result = await code_review_service.code_review(pr_url, head_sha=pr_info["head"]["sha"])
         
 
 
 async def process_webhook_event(event: sansio.Event):
+    processed = False
+    try:
+        processed = await handle_webhook_event(event)
+    finally:
+        # 处理失败或任务被取消 (arq job 超时, 关闭时的后台任务) 时释放 delivery id,
+        # 否则 GitHub 上手动 Redeliver 会被当作重复投递丢弃
+        if not processed:
+            await release_delivery(event.delivery_id)
+
+
+async def handle_webhook_event(event: sansio.Event) -> bool:
+    """
+    Authenticate as the installation and dispatch the event; returns False when it wasn't processed.
+    """
     logger.info(f"--- 后台事件处理开始: {event.event} ---")
     
     if not APP_ID or not PRIVATE_KEY:
         logger.error("App ID or Private Key is not configured. Cannot process event.")
-        return
+        return False
         
     try:
         installation_id = event.data.get("installation", {}).get("id")
         if not installation_id:
             logger.error(f"事件 {event.event} 中未找到 installation id，无法进行认证")
-            return
+            return False
 
+        session = app.state.http_session
         token = await create_installation_access_token(
+            session,
             app_id=APP_ID,
             private_key=PRIVATE_KEY,
             installation_id=installation_id,
             base_url=GITHUB_API_BASE_URL
         )
         if not token:
-            return
+            return False
 
-        async with aiohttp.ClientSession() as session:
-            gh = GitHubAPI(session, "my-bot", oauth_token=token, base_url=GITHUB_API_BASE_URL)
-            
-            await router.dispatch(event, gh)
-            logger.info(f"--- 后台事件处理完成: {event.event} ---")
+        async def refresh_token(rejected: str) -> str | None:
+            # 缓存的 token 可能已被吊销或在长时间的 code review 中过期: 只重发被 401 拒绝的那一次调用
+            logger.warning(f"Installation token for {installation_id} was rejected, regenerating.")
+            invalidate_installation_token(installation_id, rejected)
+            return await create_installation_access_token(
+                session,
+                app_id=APP_ID,
+                private_key=PRIVATE_KEY,
+                installation_id=installation_id,
+                base_url=GITHUB_API_BASE_URL
+            )
+
+        gh_service = app.state.gh_service_factory(token, refresh_token)
+        await router.dispatch(event, gh_service)
+        logger.info(f"--- 后台事件处理完成: {event.event} ---")
+        return True
             
     except Exception as e:
         logger.error(f"处理事件 {event.event} 时出错: {e}")
+        return False
+
+
+def _signature_matches(expected: str, signature: str) -> bool:
+    # Starlette decodes headers as latin-1; comparing bytes keeps non-ASCII values a plain mismatch
+    # instead of a TypeError from compare_digest
+    return hmac.compare_digest(expected.encode(), signature.encode("latin-1", "replace"))
+
+
+def verify_webhook_signature(headers, body: bytes, secret: str | None) -> bool:
+    """
+    Check X-Hub-Signature-256 (or the legacy SHA-1 X-Hub-Signature) against the raw body before anything is parsed.
+    Without a configured secret only unsigned payloads are accepted, matching gidgethub.
+    With APP_ENVIRONMENT=local a keyed BLAKE2b X-Hub-Signature-Blake2 from scripts/send_webhook.py is accepted too.
+    """
+    signature = headers.get("x-hub-signature-256", headers.get("x-hub-signature"))
+    if not secret:
+        return signature is None
+    if ACCEPT_BLAKE2_SIGNATURE and "x-hub-signature-blake2" in headers:
+        try:
+            expected = hashlib.blake2b(body, key=secret.encode("utf-8"), digest_size=32).hexdigest()
+        except ValueError:
+            # BLAKE2b keys are at most 64 bytes
+            return False
+        return _signature_matches(expected, headers["x-hub-signature-blake2"])
+    if signature is None:
+        return False
+    algo = signature.partition("=")[0]
+    if algo not in ("sha256", "sha1"):
+        return False
+    expected = f"{algo}=" + hmac.new(secret.encode("utf-8"), body, algo).hexdigest()
+    return _signature_matches(expected, signature)
+
+
+def event_from_request(headers, body: bytes, secret: str | None) -> sansio.Event:
+    """
+    Build the event from a request whose signature was already verified.
+    JSON payloads are decoded once with orjson; other content types are left to gidgethub.
+    """
+    if headers.get("content-type", "").split(";")[0].strip() != "application/json":
+        return sansio.Event.from_http(headers, body, secret=secret)
+
+    return sansio.Event(
+        orjson.loads(body),
+        event=headers["x-github-event"],
+        delivery_id=headers["x-github-delivery"],
+    )
 
 
 @app.post("/")
@@ -158,17 +309,81 @@ async def process_webhook_event(event: sansio.Event):
 async def webhook(request: Request, background_tasks: BackgroundTasks):
     body = await request.body()
     secret = os.getenv("GITHUB_WEBHOOK_SECRET")
-    
+
+    if not verify_webhook_signature(request.headers, body, secret):
+        logger.error("Webhook signature verification failed.")
+        raise HTTPException(status_code=401, detail="签名校验失败")
+
     try:
-        event = sansio.Event.from_http(request.headers, body, secret=secret)
+        event = event_from_request(request.headers, body, secret)
         logger.info(f"Webhook 事件已接收: {event.event}")
-        background_tasks.add_task(process_webhook_event, event)
-        return Response(status_code=202)
     except Exception as e:
         logger.error(f"处理 webhook 请求时出错: {e}")
         raise HTTPException(status_code=400, detail="无效的 webhook 请求")
 
+    if await is_duplicate_delivery(event.delivery_id):
+        logger.info(f"Duplicate delivery {event.delivery_id} for {event.event}, skipping.")
+        return Response(status_code=202)
+    if await enqueue_webhook_event(event):
+        return Response(status_code=202)
+    background_tasks.add_task(process_webhook_event, event)
+    return Response(status_code=202)
+
+
+async def is_duplicate_delivery(delivery_id: str) -> bool:
+    """
+    Record the delivery id in Redis and report whether it was already seen.
+    process_webhook_event releases it again if the event couldn't be processed.
+    Without Redis, or if Redis is unreachable, every delivery is treated as new.
+    """
+    redis = app.state.redis
+    if redis is None or not delivery_id:
+        return False
+    try:
+        return await redis.set(f"gh:delivery:{delivery_id}", 1, ex=DELIVERY_DEDUPE_TTL, nx=True) is None
+    except Exception as e:
+        logger.warning(f"Could not check delivery {delivery_id} in Redis: {e}")
+        return False
+
+
+async def release_delivery(delivery_id: str) -> None:
+    """
+    Forget a delivery id recorded by is_duplicate_delivery so a redelivery of it is processed again.
+    """
+    redis = app.state.redis
+    if redis is None or not delivery_id:
+        return
+    try:
+        await redis.delete(f"gh:delivery:{delivery_id}")
+    except Exception as e:
+        logger.warning(f"Could not release delivery {delivery_id} in Redis: {e}")
+
+
+async def enqueue_webhook_event(event: sansio.Event) -> bool:
+    """
+    Hand the event to the arq worker so this process can accept the next request right away.
+    Returns False when no queue is configured or Redis is unreachable, in which case the caller
+    falls back to an in-process background task.
+    """
+    arq_pool = app.state.arq_pool
+    if arq_pool is None:
+        return False
+    try:
+        await arq_pool.enqueue_job("process_webhook_job", event.event, event.delivery_id, event.data)
+        return True
+    except Exception as e:
+        logger.warning(f"Could not enqueue event {event.event} ({event.delivery_id}), processing in-process: {e}")
+        return False
+
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    # 每个 worker 是独立进程, 共享 session 与 token 缓存也是各 worker 独立一份
+    uvicorn.run(
+        "server:app",
+        host="0.0.0.0",
+        port=8000,
+        workers=int(os.getenv("WEB_CONCURRENCY", "4")),
+        loop="uvloop",
+        http="httptools",
+    )
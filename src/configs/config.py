@@ -5,6 +5,12 @@ from loguru import logger
 from dotenv import load_dotenv
 from src.configs.log_config import setup_logging
 
+# Prefer the libyaml C loader, fall back to the pure-Python SafeLoader
+try:
+    from yaml import CSafeLoader
+except ImportError:
+    from yaml import SafeLoader as CSafeLoader
+
 # append project path to sys.path
 script_path = os.path.abspath(__file__)
 project_path = os.path.dirname(os.path.dirname(os.path.dirname(script_path)))
@@ -35,7 +41,7 @@ logger.info(f"Attempting to load configuration from: {config_file_path}")
 
 try:
     with open(config_file_path) as f:
-        yaml_configs = yaml.load(f, Loader=yaml.FullLoader)
+        yaml_configs = yaml.load(f, Loader=CSafeLoader)
     logger.info(f"Successfully loaded configuration from {config_file_name}")
 except FileNotFoundError:
     logger.error(f"Configuration file '{config_file_name}' not found. Please ensure it exists.")
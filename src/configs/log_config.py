@@ -1,22 +1,48 @@
 import sys
-import json
+import orjson
 import os
 import logging
+import re
 from loguru import logger
 
+# Health check probes hit "/" and "/webhook/"
+_HC_RE = re.compile(r'"GET (?:/|/webhook/) HTTP/1\.1"')
+
+_SOURCE_LOC_KEY = "logging.googleapis.com/sourceLocation"
+
+# One GCP log line; only message and file path need JSON escaping, the rest is substituted as-is
+_GCP_LINE = (
+    b'{"severity":"%s","message":%s,"timestamp":"%s",'
+    b'"' + _SOURCE_LOC_KEY.encode() + b'":{"file":%s,"line":%d,"function":"%s"}}\n'
+)
+
+# (epoch second, b"YYYY-MM-DDTHH:MM:SS", b"+HH:MM") of the last timestamp formatted by the sink
+_last_ts = (None, b"", b"")
+
+def _gcp_timestamp(t) -> bytes:
+    """
+    RFC 3339 timestamp for a record; the date/time part is formatted once per second
+    and reused, only the microseconds change between records.
+    """
+    global _last_ts
+    sec = int(t.timestamp())
+    cached = _last_ts
+    if cached[0] != sec:
+        iso = t.isoformat(timespec="seconds").encode()
+        cached = _last_ts = (sec, iso[:19], iso[19:])
+    return b"%s.%06d%s" % (cached[1], t.microsecond, cached[2])
+
 class EndpointFilter(logging.Filter):
     def filter(self, record: logging.LogRecord) -> bool:
-        return record.getMessage().find("GET / HTTP/1.1") == -1
+        return _HC_RE.search(record.getMessage()) is None
 
 def health_check_filter(record):
     """
     Filters out uvicorn access logs for health check endpoints.
     """
-    is_access_log = record["name"] == "uvicorn.access"
-    if is_access_log:
-        message = record["message"]
-        if '"GET / HTTP/1.1"' in message or '"GET /webhook/ HTTP/1.1"' in message:
-            return False
+    # Application records skip the regex entirely
+    if record["name"] == "uvicorn.access" and _HC_RE.search(record["message"]):
+        return False
     return True
 
 def setup_logging(app_env_variable: str = "local"):
@@ -28,23 +54,30 @@ def setup_logging(app_env_variable: str = "local"):
 
     logger.remove()
 
+    # DEBUG (full headers / payloads) only locally unless LOG_LEVEL says otherwise;
+    # records below the sink level skip formatting, lazy arguments are never evaluated
+    level = os.getenv("LOG_LEVEL", "DEBUG" if app_env_variable == "local" else "INFO").upper()
+
     if app_env_variable != "local":
-        def gcp_formatter(record):
-            log_entry = {
-                "severity": record["level"].name,
-                "message": record["message"],
-                "timestamp": record["time"].isoformat(),
-                "logging.googleapis.com/sourceLocation": {
-                    "file": record["file"].path,
-                    "line": record["line"],
-                    "function": record["function"],
-                },
-            }
-            record["extra"]["json_message"] = json.dumps(log_entry)
-            return "{extra[json_message]}\n"
-
-        logger.add(sys.stdout, format=gcp_formatter, level="DEBUG", filter=health_check_filter)
+        def gcp_sink(message):
+            record = message.record
+            line = _GCP_LINE % (
+                record["level"].name.encode(),
+                orjson.dumps(record["message"]),
+                _gcp_timestamp(record["time"]),
+                orjson.dumps(record["file"].path),
+                record["line"],
+                record["function"].encode(),
+            )
+            # Write bytes straight to stdout; flush per line so container logs aren't held in the buffer
+            sys.stdout.buffer.write(line)
+            sys.stdout.buffer.flush()
+
+        # enqueue=True runs the sink, JSON building included, on loguru's background thread
+        logger.add(gcp_sink, format="{message}", level=level, filter=health_check_filter,
+                   enqueue=True, backtrace=False, diagnose=False)
         logger.info("Loguru configured for custom JSON output to stdout for GCP.")
     else:
-        logger.add(sys.stderr, level="DEBUG", filter=health_check_filter)
+        logger.add(sys.stderr, level=level, filter=health_check_filter,
+                   enqueue=True, backtrace=False, diagnose=False)
         logger.info("Loguru configured for standard terminal output.")
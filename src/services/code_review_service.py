@@ -1,41 +1,107 @@
 from src.services.gh_service import GithubService
 from src.configs.config import yaml_configs
 from loguru import logger
+from cachetools import TTLCache
+import asyncio
 import aiohttp
-import json
+import orjson
+from tenacity import (
+    AsyncRetrying,
+    retry_if_exception_type,
+    retry_if_result,
+    stop_after_attempt,
+    wait_exponential,
+)
 
 review_url = yaml_configs['py_github_agent']['review_url']
 
+# (pr_url, head_sha) -> review report. GitHub redeliveries and re-triggers for the same commit reuse it.
+_review_cache: TTLCache = TTLCache(maxsize=512, ttl=600)
+# Reviews currently in flight, so concurrent requests for the same commit share one upstream call.
+_review_inflight: dict[tuple[str, str], asyncio.Future] = {}
+
+# Reviews can take minutes, so keep the overall budget but fail fast on connect.
+REVIEW_TIMEOUT = aiohttp.ClientTimeout(total=300, connect=10)
+REVIEW_ATTEMPTS = 3
+
+
+def _review_retrying() -> AsyncRetrying:
+    """
+    Retry transient failures (connection errors, 5xx) with exponential backoff.
+    Once attempts run out the last response or exception is passed through unchanged.
+    """
+    return AsyncRetrying(
+        stop=stop_after_attempt(REVIEW_ATTEMPTS),
+        wait=wait_exponential(multiplier=1, min=1, max=10),
+        retry=retry_if_exception_type(aiohttp.ClientError) | retry_if_result(lambda r: r[0] >= 500),
+        retry_error_callback=lambda state: state.outcome.result(),
+    )
+
 
 
 class CodeReviewService:
-    def __init__(self, gs: GithubService):
+    def __init__(self, gs: GithubService, session: aiohttp.ClientSession):
         self.gs = gs
+        self.session = session
 
-    async def get_code_review_rpt(self,prurl: str) -> dict:
+    async def get_code_review_rpt(self, prurl: str, head_sha: str | None = None) -> dict:
         """
         Generate a code review report for the given pull request URL.
-        Makes an HTTP POST request to an external service.
+        When the head commit SHA is given, successful reports are cached per (prurl, head_sha)
+        and concurrent calls for the same key wait on the same upstream request.
+        """
+        if head_sha is None:
+            return await self._request_code_review_rpt(prurl)
+
+        key = (prurl, head_sha)
+        while True:
+            # No await between the lookups and the registration, so this is atomic on the event loop.
+            cached = _review_cache.get(key)
+            if cached is not None:
+                logger.info(f"Reusing cached code review for {prurl}@{head_sha}")
+                return cached
+            inflight = _review_inflight.get(key)
+            if inflight is None:
+                break
+            report = await asyncio.shield(inflight)
+            if report is not None:
+                return report
+            # The owning call was cancelled or raised; look again and request it ourselves if needed.
+
+        inflight = asyncio.get_running_loop().create_future()
+        _review_inflight[key] = inflight
+        try:
+            report = await self._request_code_review_rpt(prurl)
+        except BaseException:
+            # Waiters get None rather than our CancelledError, so another webhook isn't cancelled with us.
+            inflight.set_result(None)
+            raise
+        finally:
+            _review_inflight.pop(key, None)
+        if 'review_report' in report:
+            _review_cache[key] = report
+        inflight.set_result(report)
+        return report
+
+    async def _request_code_review_rpt(self, prurl: str) -> dict:
+        """
+        Makes an HTTP POST request to the external review service.
         Includes error handling for network issues and non-successful HTTP status codes.
         """
         payload = {"pull_request_url": prurl}
         
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.post(review_url, json=payload, timeout=300) as resp:
-                    # Check for successful HTTP status code
-                    if resp.status == 200:
-                        # Parse JSON response
-                        response_data = await resp.json()
-                        return response_data
-                    else:
-                        # Log error and return an informative message
-                        error_text = await resp.text()
-                        logger.error(
-                            f"Failed to get code review report. "
-                            f"Status: {resp.status}, Response: {error_text}"
-                        )
-                        return {"error": f"Received status {resp.status} from review service."}
+            status, body = await _review_retrying()(self._post_review, payload)
+            # Check for successful HTTP status code
+            if status == 200:
+                return body
+            else:
+                # Log error and return an informative message
+                logger.error(
+                    f"Failed to get code review report. "
+                    f"Status: {status}, Response: {body}"
+                )
+                return {"error": f"Received status {status} from review service."}
 
         except aiohttp.ClientError as e:
             # Handle client-side exceptions (e.g., connection error, timeout)
@@ -46,18 +112,27 @@ class CodeReviewService:
             logger.error(f"An unexpected error occurred: {e}")
             return {"error": f"An unexpected error occurred. {e}"}
 
+    async def _post_review(self, payload: dict) -> tuple[int, dict | str]:
+        """
+        One POST to the review service; returns the status with the parsed JSON on 200, else the raw text.
+        """
+        async with self.session.post(review_url, json=payload, timeout=REVIEW_TIMEOUT) as resp:
+            if resp.status == 200:
+                return resp.status, await resp.json()
+            return resp.status, await resp.text()
+
 
-    async def code_review(self, pr_url: str) -> str:
+    async def code_review(self, pr_url: str, head_sha: str | None = None) -> str:
         """
         Wrapper function to get code review report.
         """
         words = "failed to get review.., please try again later."
-        review_rs = await self.get_code_review_rpt(pr_url)
+        review_rs = await self.get_code_review_rpt(pr_url, head_sha)
         if isinstance(review_rs, dict) and 'review_report' in review_rs:
             words = review_rs['review_report']
         elif isinstance(review_rs, dict):
             logger.error(f"Code review service returned an error: {review_rs}")
-            words = json.dumps(review_rs)
+            words = orjson.dumps(review_rs).decode()
         else:
             logger.error(f"Code review service returned an error: {review_rs}")
             words = str(review_rs)
@@ -2,47 +2,208 @@ import os
 import src.configs.config
 from loguru import logger
 
+import asyncio
+import re
 import aiohttp
-from gidgethub.aiohttp import GitHubAPI
+import httpx
+from gidgethub import httpx as gh_httpx
+from gidgethub.abc import GitHubAPI
 import time
 import jwt
-from urllib.parse import urlparse
+from cryptography.hazmat.primitives.asymmetric.rsa import RSAPrivateKey
+from collections import defaultdict
+from collections.abc import Awaitable, Callable, Mapping
+from datetime import datetime
+from tenacity import AsyncRetrying, retry_if_result, stop_after_attempt, wait_exponential
+
+_PR_URL_RE = re.compile(r"^https?://[^/]+/(?P<owner>[^/]+)/(?P<repo>[^/]+)/pull/(?P<num>\d+)")
+
+# Installation tokens are valid for one hour; refresh them this many seconds before expiry.
+TOKEN_REFRESH_MARGIN = 300
+
+# installation_id -> (token, expiry as epoch seconds)
+_token_cache: dict[int, tuple[str, float]] = {}
+# One lock per installation so concurrent webhooks don't all mint a new token at once.
+_token_locks: defaultdict[int, asyncio.Lock] = defaultdict(asyncio.Lock)
+
+# App JWTs are valid for any installation; mint one for 9 minutes and renew when under a minute is left.
+APP_JWT_LIFETIME = 9 * 60
+APP_JWT_REFRESH_MARGIN = 60
+
+# app_id -> (jwt, exp as epoch seconds)
+_app_jwt: dict[str, tuple[str, int]] = {}
+_app_jwt_lock = asyncio.Lock()
+
+
+async def get_app_jwt(app_id: str, private_key: RSAPrivateKey | str) -> str:
+    """
+    Return a JWT authenticating as the GitHub App, signing a new one only when the cached one is about to expire.
+    """
+    async with _app_jwt_lock:
+        cached = _app_jwt.get(app_id)
+        if cached and cached[1] - time.time() > APP_JWT_REFRESH_MARGIN:
+            return cached[0]
+        now = int(time.time())
+        exp = now + APP_JWT_LIFETIME
+        payload = {
+            'iat': now,
+            'exp': exp,
+            'iss': app_id
+        }
+        jwt_token = jwt.encode(payload, private_key, algorithm='RS256')
+        _app_jwt[app_id] = (jwt_token, exp)
+        return jwt_token
+
+
+def invalidate_installation_token(installation_id: int, token: str | None = None) -> None:
+    """
+    Drop the cached token for an installation, e.g. after GitHub rejected it with a 401.
+    When the rejected token is given, a newer token already cached by a concurrent refresh is kept.
+    """
+    cached = _token_cache.get(installation_id)
+    if cached and (token is None or cached[0] == token):
+        del _token_cache[installation_id]
+
 
 async def create_installation_access_token(
+    session: aiohttp.ClientSession,
     app_id: str,
-    private_key: str,
+    private_key: RSAPrivateKey | str,
     installation_id: str,
     base_url: str = "https://api.github.com"
 ) -> str:
     """
     Manually create an installation access token.
     This is useful for GitHub Enterprise Server where gidgethub helpers might not work.
+    The caller's shared session is reused so the token exchange rides on the pooled connections.
+    Tokens are cached per installation until shortly before they expire.
     """
-    def generate_jwt(app_id, private_key):
-        payload = {
-            'iat': int(time.time()),
-            'exp': int(time.time()) + (10 * 60),  # 10 minutes expiration
-            'iss': app_id
-        }
-        return jwt.encode(payload, private_key, algorithm='RS256')
+    async with _token_locks[installation_id]:
+        cached = _token_cache.get(installation_id)
+        if cached and cached[1] - time.time() > TOKEN_REFRESH_MARGIN:
+            return cached[0]
+        return await _request_installation_access_token(session, app_id, private_key, installation_id, base_url)
+
 
-    jwt_token = generate_jwt(app_id, private_key)
+async def _request_installation_access_token(
+    session: aiohttp.ClientSession,
+    app_id: str,
+    private_key: RSAPrivateKey | str,
+    installation_id: str,
+    base_url: str
+) -> str:
+    jwt_token = await get_app_jwt(app_id, private_key)
     headers = {
         'Authorization': f'Bearer {jwt_token}',
         'Accept': 'application/vnd.github+json'
     }
     url = f"{base_url}/app/installations/{installation_id}/access_tokens"
 
-    # Use a shared session if available, or create a new one
-    async with aiohttp.ClientSession() as session:
-        async with session.post(url, headers=headers) as response:
-            if response.status == 201:
-                data = await response.json()
-                return data.get('token')
-            else:
-                error_text = await response.text()
-                logger.error(f"Failed to get installation token: {response.status} - {error_text}")
-                return None
+    async with session.post(url, headers=headers) as response:
+        if response.status == 201:
+            data = await response.json()
+            token = data.get('token')
+            expires_at = data.get('expires_at')
+            if token and expires_at:
+                _token_cache[installation_id] = (token, datetime.fromisoformat(expires_at).timestamp())
+            return token
+        else:
+            error_text = await response.text()
+            logger.error(f"Failed to get installation token: {response.status} - {error_text}")
+            return None
+
+
+# At most this many GitHub API calls in flight per worker, to stay clear of secondary rate limits.
+GITHUB_MAX_CONCURRENCY = 10
+# Never sleep longer than this between rate-limited attempts.
+RATE_LIMIT_MAX_WAIT = 30
+
+
+def _is_rate_limited(response: tuple[int, Mapping[str, str], bytes]) -> bool:
+    status, headers, body = response
+    if status not in (403, 429):
+        return False
+    return (
+        "retry-after" in headers
+        or headers.get("x-ratelimit-remaining") == "0"
+        or b"rate limit" in body.lower()
+    )
+
+
+def _advertised_wait(headers: Mapping[str, str]) -> float | None:
+    """
+    Seconds GitHub asked us to wait via Retry-After / X-RateLimit-Reset, or None when it didn't say.
+    """
+    if "retry-after" in headers:
+        return float(headers["retry-after"])
+    if headers.get("x-ratelimit-remaining") == "0" and "x-ratelimit-reset" in headers:
+        return float(headers["x-ratelimit-reset"]) - time.time()
+    return None
+
+
+def _rate_limit_wait(retry_state) -> float:
+    """
+    Honour Retry-After / X-RateLimit-Reset when GitHub sends them, otherwise back off exponentially.
+    """
+    _, headers, _ = retry_state.outcome.result()
+    delay = _advertised_wait(headers)
+    if delay is None:
+        delay = wait_exponential(multiplier=1, max=RATE_LIMIT_MAX_WAIT)(retry_state)
+    return min(max(delay, 0.0), RATE_LIMIT_MAX_WAIT)
+
+
+def _rate_limit_outlasts_wait(retry_state) -> bool:
+    """
+    Stop when GitHub's advertised wait is longer than we are willing to sleep, since retrying early would fail anyway.
+    """
+    _, headers, _ = retry_state.outcome.result()
+    delay = _advertised_wait(headers)
+    return delay is not None and delay > RATE_LIMIT_MAX_WAIT
+
+
+class ThrottledGitHubAPI(gh_httpx.GitHubAPI):
+    """
+    httpx-backed GitHubAPI that shares a semaphore across all clients of a worker and
+    retries rate-limited responses; gidgethub raises as usual once retries run out, or right away
+    when the limit resets later than RATE_LIMIT_MAX_WAIT.
+    With refresh_token set, a call rejected with 401 is sent once more with the token it returns,
+    so only that call is repeated and later calls on this client use the new token.
+    """
+    def __init__(
+        self,
+        client: httpx.AsyncClient,
+        *args,
+        semaphore: asyncio.Semaphore,
+        refresh_token: Callable[[str], Awaitable[str | None]] | None = None,
+        **kwargs,
+    ):
+        self._semaphore = semaphore
+        self._refresh_token = refresh_token
+        super().__init__(client, *args, **kwargs)
+
+    async def _request(self, method: str, url: str, headers: Mapping[str, str], body: bytes = b""):
+        response = await self._rate_limited_request(method, url, headers, body)
+        if response[0] != 401 or self._refresh_token is None or not self.oauth_token:
+            return response
+        token = await self._refresh_token(self.oauth_token)
+        if not token:
+            return response
+        self.oauth_token = token
+        headers = {**headers, "authorization": f"token {token}"}
+        return await self._rate_limited_request(method, url, headers, body)
+
+    async def _rate_limited_request(self, method: str, url: str, headers: Mapping[str, str], body: bytes):
+        retrying = AsyncRetrying(
+            stop=stop_after_attempt(4) | _rate_limit_outlasts_wait,
+            wait=_rate_limit_wait,
+            retry=retry_if_result(_is_rate_limited),
+            retry_error_callback=lambda state: state.outcome.result(),
+        )
+        return await retrying(self._throttled_request, method, url, headers, body)
+
+    async def _throttled_request(self, method: str, url: str, headers: Mapping[str, str], body: bytes):
+        async with self._semaphore:
+            return await super()._request(method, url, headers, body)
 
 
 class GithubService:
@@ -64,27 +225,20 @@ class GithubService:
         """
         Posts a general comment to a pull request by parsing its URL.
         """
-        try:
-            parsed_url = urlparse(pr_url)
-            path_parts = parsed_url.path.strip('/').split('/')
-            
-            if len(path_parts) >= 4 and path_parts[2] == 'pull':
-                owner, repo_name, _, pr_number_str = path_parts[:4]
-                pr_number = int(pr_number_str)
-                logger.info(f"Parsed PR URL: owner='{owner}', repo='{repo_name}', number={pr_number}")
-                
-                return await self.post_general_pr_comment(
-                    owner=owner,
-                    repo_name=repo_name,
-                    pr_number=pr_number,
-                    comment_body=comment_body
-                )
-            else:
-                logger.error(f"Invalid GitHub PR URL format: {pr_url}")
-                return {"error": "Invalid GitHub PR URL format."}
-        except (ValueError, IndexError) as e:
-            logger.error(f"Could not parse PR URL '{pr_url}': {e}")
-            return {"error": f"Could not parse URL: {e}"}
+        m = _PR_URL_RE.match(pr_url)
+        if not m:
+            logger.error(f"Invalid GitHub PR URL format: {pr_url}")
+            return {"error": "Invalid GitHub PR URL format."}
+
+        owner, repo_name, pr_number = m["owner"], m["repo"], int(m["num"])
+        logger.info(f"Parsed PR URL: owner='{owner}', repo='{repo_name}', number={pr_number}")
+
+        return await self.post_general_pr_comment(
+            owner=owner,
+            repo_name=repo_name,
+            pr_number=pr_number,
+            comment_body=comment_body
+        )
 
     async def post_general_pr_comment(self, owner: str, repo_name: str, pr_number: int, comment_body: str):
         """
@@ -106,6 +260,20 @@ class GithubService:
         return await self.gh.post(url, data={"body": comment_body})
         
 
+    async def add_labels(self, owner: str, repo_name: str, issue_number: int, labels: list[str]):
+        """
+        给 issue / PR 添加 labels (PR 同样走 issues API)。
+        """
+        url = f"/repos/{owner}/{repo_name}/issues/{issue_number}/labels"
+        return await self.gh.post(url, data={"labels": labels})
+
+    async def request_reviewers(self, owner: str, repo_name: str, pr_number: int, reviewers: list[str]):
+        """
+        为 PR 请求 reviewers。
+        """
+        url = f"/repos/{owner}/{repo_name}/pulls/{pr_number}/requested_reviewers"
+        return await self.gh.post(url, data={"reviewers": reviewers})
+
     async def post_line_comment_in_pr(self, owner: str, repo_name: str, pr_number: int, comment_body: str, commit_id: str, file_path: str, line_number: int):
         """
         在 PR 的某一行代码上发表一个审查评论 (Review Comment)。
@@ -0,0 +1,40 @@
+"""
+arq worker that processes GitHub webhook events outside the web process.
+
+Run with:
+    arq src.workers.webhook_worker.WorkerSettings
+"""
+import os
+
+from arq.connections import RedisSettings
+from gidgethub import sansio
+
+import server
+from src.services.code_review_service import REVIEW_ATTEMPTS, REVIEW_TIMEOUT
+
+
+async def startup(ctx):
+    # Reuse the web app's lifespan so the worker gets the same shared clients
+    ctx["lifespan"] = server.lifespan(server.app)
+    await ctx["lifespan"].__aenter__()
+
+
+async def shutdown(ctx):
+    await ctx["lifespan"].__aexit__(None, None, None)
+
+
+async def process_webhook_job(ctx, event_name: str, delivery_id: str, data: dict):
+    event = sansio.Event(data, event=event_name, delivery_id=delivery_id)
+    await server.process_webhook_event(event)
+
+
+class WorkerSettings:
+    functions = [process_webhook_job]
+    on_startup = startup
+    on_shutdown = shutdown
+    # A pull_request.opened job can spend every review attempt at the full timeout, plus backoff and
+    # the GitHub calls around it; arq's default of 300 s would cancel it before the comment is posted.
+    job_timeout = REVIEW_ATTEMPTS * REVIEW_TIMEOUT.total + 180
+    # Handlers post comments, so a job cancelled on shutdown must not be re-run from the start.
+    max_tries = 1
+    redis_settings = RedisSettings.from_dsn(os.getenv("ARQ_REDIS_URL", "redis://localhost:6379"))
@@ -0,0 +1 @@
+# This file makes the 'configs' directory a sub-package.
@@ -0,0 +1,51 @@
+import src.configs.config
+from loguru import logger
+import orjson
+import pytest
+
+from src.configs.log_config import setup_logging
+
+
+@pytest.fixture
+def gcp_logging(monkeypatch):
+    """
+    Switch to the GCP JSON sink (default level) for one test and restore the configured sinks afterwards.
+    """
+    monkeypatch.delenv("LOG_LEVEL", raising=False)
+    setup_logging("prod")
+    yield
+    setup_logging(src.configs.config.app_env)
+
+
+def test_gcp_sink_writes_one_json_object_per_line(gcp_logging, capsys):
+    logger.warning('quote " backslash \\ newline \n 中文')
+    logger.complete()
+
+    lines = [line for line in capsys.readouterr().out.splitlines() if line]
+    entry = orjson.loads(lines[-1])
+    assert entry["severity"] == "WARNING"
+    assert entry["message"] == 'quote " backslash \\ newline \n 中文'
+    assert entry["logging.googleapis.com/sourceLocation"]["function"] == "test_gcp_sink_writes_one_json_object_per_line"
+    assert entry["logging.googleapis.com/sourceLocation"]["line"] > 0
+
+
+def test_gcp_timestamp_matches_isoformat():
+    from datetime import datetime, timedelta, timezone
+    from src.configs.log_config import _gcp_timestamp
+
+    tz = timezone(timedelta(hours=8))
+    for t in (
+        datetime(2026, 1, 2, 3, 4, 5, 6, tzinfo=tz),
+        datetime(2026, 1, 2, 3, 4, 5, 999999, tzinfo=tz),  # same second, cached prefix
+        datetime(2026, 1, 2, 3, 4, 6, 0, tzinfo=timezone.utc),
+    ):
+        assert _gcp_timestamp(t).decode() == t.isoformat(timespec="microseconds")
+
+
+def test_gcp_sink_drops_debug_payloads(gcp_logging, capsys):
+    calls = []
+    logger.opt(lazy=True).debug("payload: {}", lambda: calls.append(1))
+    logger.complete()
+
+    assert calls == []
+    assert "payload:" not in capsys.readouterr().out
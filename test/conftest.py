@@ -0,0 +1,64 @@
+import src.configs.config  # also loads .env (load_dotenv at import)
+
+import os
+import shelve
+
+import pytest
+import pytest_asyncio
+
+# aiohttp / gidgethub / services are imported inside the fixtures, so runs that
+# don't touch the integration tests (e.g. pytest test/test_1.py) skip those imports.
+
+
+@pytest_asyncio.fixture(scope="session", loop_scope="session")
+async def http_session():
+    """
+    One aiohttp.ClientSession for the whole test session, so integration tests
+    reuse pooled keep-alive connections instead of a new TCP + TLS handshake per test.
+    Tests using it must run on the session loop: @pytest.mark.asyncio(loop_scope="session").
+    """
+    import aiohttp
+
+    async with aiohttp.ClientSession() as session:
+        yield session
+
+
+@pytest.fixture(scope="session")
+def gh_cache(request):
+    """
+    ETag / Last-Modified cache handed to GitHubAPI(cache=...). gidgethub sends
+    If-None-Match on repeat GETs, and 304 responses are served from here without
+    counting against the rate limit. Kept under .pytest_cache so re-runs reuse it.
+    """
+    if getattr(request.config, "cache", None) is None:
+        # cacheprovider disabled (-p no:cacheprovider): cache for this run only
+        yield {}
+        return
+    # one file per xdist worker, shelve does not support concurrent writers
+    worker = os.getenv("PYTEST_XDIST_WORKER", "main")
+    path = request.config.cache.mkdir("gh-etag-cache") / f"responses-{worker}"
+    with shelve.open(str(path)) as cache:
+        yield cache
+
+
+@pytest.fixture(scope="session")
+def gh_api(http_session, gh_cache):
+    """
+    GitHubAPI shared by all integration tests; skips them when GITHUB_TOKEN is not set.
+    """
+    from gidgethub.aiohttp import GitHubAPI
+
+    token = os.getenv("GITHUB_TOKEN")
+    if not token:
+        pytest.skip("GITHUB_TOKEN is not set, skipping integration test.")
+    return GitHubAPI(http_session, "py-webhook-svc", oauth_token=token, cache=gh_cache, base_url="https://api.github.com")
+
+
+@pytest.fixture(scope="session")
+def gh_service(gh_api):
+    """
+    One GithubService for the whole test session, on the shared gh_api.
+    """
+    from src.services.gh_service import GithubService
+
+    return GithubService(gh_api)
@@ -1,13 +1,11 @@
 import src.configs.config
 from loguru import logger
 
-import aiohttp
-import asyncio
-from gidgethub.aiohttp import GitHubAPI
 import os
-from gidgethub import sansio
 import pytest
 
+GITHUB_TOKEN = os.getenv("GITHUB_TOKEN")
+
 
 def test_hello():
     logger.info("test hello!")
@@ -18,18 +16,23 @@ async def test_github_api_creation():
     """
     Tests that the GithubAPI object can be created without errors.
     """
+    if not GITHUB_TOKEN:
+        pytest.skip("GITHUB_TOKEN is not set, skipping integration test.")
+    import aiohttp
+    from gidgethub import sansio
+    from gidgethub.aiohttp import GitHubAPI
+
     logger.info("Testing GitHubAPI creation...")
-    logger.info(f"GITHUB_TOKEN: {os.getenv('GITHUB_TOKEN')[:10]}...")
     async with aiohttp.ClientSession() as session:
-        gh = GitHubAPI(session, "nvd11", oauth_token=os.getenv("GITHUB_TOKEN"))
+        gh = GitHubAPI(session, "nvd11", oauth_token=GITHUB_TOKEN)
         assert gh is not None
 
 
         # You can add more specific assertions here.
         # For example, check if the headers are set correctly.
-        headers = sansio.create_headers("nvd11", oauth_token=os.getenv("GITHUB_TOKEN"))
+        headers = sansio.create_headers("nvd11", oauth_token=GITHUB_TOKEN)
         assert "authorization" in headers
-        assert headers["authorization"] == f"token {os.getenv('GITHUB_TOKEN')}"
+        assert headers["authorization"] == f"token {GITHUB_TOKEN}"
 
 
 
@@ -2,57 +2,42 @@ import src.configs.config
 from loguru import logger
 import pytest
 import pytest_asyncio
-import os
-from dotenv import load_dotenv
-from gidgethub.aiohttp import GitHubAPI
+import asyncio
 import aiohttp
 
 from src.services.code_review_service import CodeReviewService
-from src.services.gh_service import GithubService
-
-# Load environment variables from .env file
-load_dotenv()
 
 @pytest.mark.integration
+@pytest.mark.asyncio(loop_scope="session")
 class TestCodeReviewServiceIntegration:
     """
     A test class for full, end-to-end integration tests of the CodeReviewService.
     These tests require a valid GITHUB_TOKEN and make real API calls.
     """
     
-    @pytest_asyncio.fixture(scope="function", autouse=True)
-    async def services(self):
+    @pytest_asyncio.fixture(scope="class", loop_scope="session", autouse=True)
+    async def services(self, request, http_session, gh_service):
         """
-        Set up the necessary service instances for all tests in this class.
-        This runs once before any tests in the module are executed.
+        Set up the necessary service instances once for all tests in this class,
+        on top of the session-wide GithubService (skipped when GITHUB_TOKEN is not set).
         """
-        github_token = os.getenv("GITHUB_TOKEN")
-        if not github_token:
-            logger.error("GITHUB_TOKEN not found in environment. Skipping integration tests.")
-            pytest.skip("SKIPPING INTEGRATION TESTS: GITHUB_TOKEN not found in environment.")
-            
-        async with aiohttp.ClientSession() as session:
-            gh_api = GitHubAPI(session, "py-webhook-svc-tester", oauth_token=github_token)
-            self.gh_service = GithubService(gh=gh_api)
-            self.code_review_service = CodeReviewService(gs=self.gh_service)
-            yield
-        # Teardown is handled by the async with block
-
-    @pytest.mark.asyncio
+        request.cls.gh_service = gh_service
+        request.cls.code_review_service = CodeReviewService(gs=gh_service, session=http_session)
+        yield
+
     async def test_get_code_review_rpt_integration_success(self):
         """Tests the success case for get_code_review_rpt."""
         pr_url = "https://github.com/nvd11/py-webhook-svc/pull/5"
-        report = await self.code_review_service.get_code_review_rpt(pr_url, "dummy_token")
+        report = await self.code_review_service.get_code_review_rpt(pr_url)
         assert isinstance(report, dict) and 'review_report' in report and len(report['review_report']) > 0
 
-    @pytest.mark.asyncio
     async def test_get_code_review_rpt_integration_invalid_url(self):
         """
         Tests the failure case for get_code_review_rpt where the URL is invalid.
         The review service returns a review_report with an error message.
         """
         pr_url = "https://github.com/this/repo-does-not-exist/pull/99999"
-        report = await self.code_review_service.get_code_review_rpt(pr_url, "dummy_token")
+        report = await self.code_review_service.get_code_review_rpt(pr_url)
         
         # Assert that the service correctly relays the "not found" message.
         assert isinstance(report, dict)
@@ -71,7 +56,6 @@ class TestCodeReviewServiceIntegration:
         # Check if any of the possible messages are in the review message.
         assert any(msg in review_message for msg in possible_error_messages)
 
-    @pytest.mark.asyncio
     async def test_code_review_full_workflow(self):
         """
         Tests the full end-to-end workflow of the code_review method.
@@ -91,3 +75,154 @@ class TestCodeReviewServiceIntegration:
         assert "body" in response
         assert response["body"].strip() != "" # Ensure the review body is not empty
         logger.info(f"Successfully posted comment with ID: {response['id']}")
+
+
+@pytest.mark.asyncio
+async def test_get_code_review_rpt_is_cached_per_head_sha():
+    """
+    Concurrent and repeated reviews of the same commit hit the review service once.
+    """
+    calls = []
+
+    async def fake_request(prurl):
+        calls.append(prurl)
+        await asyncio.sleep(0)
+        return {"review_report": "looks good"}
+
+    service = CodeReviewService(gs=None, session=None)
+    service._request_code_review_rpt = fake_request
+    pr_url = "https://github.com/nvd11/py-webhook-svc/pull/5"
+
+    reports = await asyncio.gather(*(service.get_code_review_rpt(pr_url, "abc123") for _ in range(3)))
+    again = await service.get_code_review_rpt(pr_url, "abc123")
+    assert all(r == {"review_report": "looks good"} for r in reports) and again == reports[0]
+    assert len(calls) == 1
+
+    await service.get_code_review_rpt(pr_url, "def456")
+    assert len(calls) == 2
+
+
+@pytest.mark.asyncio
+async def test_waiters_fall_back_when_the_owning_review_is_cancelled():
+    """
+    Cancelling the webhook that owns the in-flight review doesn't cancel the ones waiting on it.
+    """
+    started = asyncio.Event()
+    calls = []
+
+    async def fake_request(prurl):
+        calls.append(prurl)
+        if len(calls) == 1:
+            started.set()
+            await asyncio.sleep(3600)
+        return {"review_report": "looks good"}
+
+    service = CodeReviewService(gs=None, session=None)
+    service._request_code_review_rpt = fake_request
+    pr_url = "https://github.com/nvd11/py-webhook-svc/pull/5"
+
+    owner = asyncio.create_task(service.get_code_review_rpt(pr_url, "cancel1"))
+    await started.wait()
+    waiter = asyncio.create_task(service.get_code_review_rpt(pr_url, "cancel1"))
+    await asyncio.sleep(0)
+    owner.cancel()
+
+    assert await waiter == {"review_report": "looks good"}
+    assert owner.cancelled()
+    assert len(calls) == 2
+
+
+class _FakeReviewResponse:
+    def __init__(self, status: int, body):
+        self.status = status
+        self._body = body
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def json(self):
+        return self._body
+
+    async def text(self):
+        return str(self._body)
+
+
+class _FakeReviewSession:
+    """
+    Stands in for aiohttp.ClientSession; each post() plays the next scripted response or raises the next exception.
+    """
+    def __init__(self, *outcomes):
+        self.outcomes = list(outcomes)
+        self.calls = 0
+
+    def post(self, url, json=None, timeout=None):
+        self.calls += 1
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return _FakeReviewResponse(*outcome)
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    """
+    Skip tenacity's backoff sleeps and record the requested delays.
+    """
+    delays = []
+    real_sleep = asyncio.sleep
+
+    async def fake_sleep(delay, *args, **kwargs):
+        delays.append(delay)
+        await real_sleep(0)
+
+    monkeypatch.setattr(asyncio, "sleep", fake_sleep)
+    return delays
+
+
+@pytest.mark.asyncio
+async def test_review_request_retries_transient_failures(sleeps):
+    session = _FakeReviewSession(
+        (502, "bad gateway"),
+        aiohttp.ClientConnectionError("connection reset"),
+        (200, {"review_report": "looks good"}),
+    )
+    service = CodeReviewService(gs=None, session=session)
+
+    report = await service.get_code_review_rpt("https://github.com/nvd11/py-webhook-svc/pull/5")
+    assert report == {"review_report": "looks good"}
+    assert session.calls == 3
+    assert len(sleeps) == 2
+
+
+@pytest.mark.asyncio
+async def test_review_request_returns_the_last_error_once_attempts_run_out(sleeps):
+    session = _FakeReviewSession((503, "unavailable"), (503, "unavailable"), (503, "unavailable"))
+    service = CodeReviewService(gs=None, session=session)
+
+    report = await service.get_code_review_rpt("https://github.com/nvd11/py-webhook-svc/pull/5")
+    assert report == {"error": "Received status 503 from review service."}
+    assert session.calls == 3
+
+
+@pytest.mark.asyncio
+async def test_review_request_returns_the_last_client_error_once_attempts_run_out(sleeps):
+    session = _FakeReviewSession(*(aiohttp.ClientConnectionError("refused") for _ in range(3)))
+    service = CodeReviewService(gs=None, session=session)
+
+    report = await service.get_code_review_rpt("https://github.com/nvd11/py-webhook-svc/pull/5")
+    assert report["error"].startswith("Could not connect to the review service.")
+    assert session.calls == 3
+
+
+@pytest.mark.asyncio
+async def test_review_request_does_not_retry_client_errors(sleeps):
+    session = _FakeReviewSession((404, "not found"))
+    service = CodeReviewService(gs=None, session=session)
+
+    report = await service.get_code_review_rpt("https://github.com/nvd11/py-webhook-svc/pull/5")
+    assert report == {"error": "Received status 404 from review service."}
+    assert session.calls == 1
+    assert sleeps == []
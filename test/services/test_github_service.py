@@ -2,42 +2,186 @@ import src.configs.config
 from loguru import logger
 
 import pytest
-from src.services.gh_service import GithubService
-import os
+from src.services.gh_service import (
+    GithubService,
+    ThrottledGitHubAPI,
+    create_installation_access_token,
+    get_app_jwt,
+    invalidate_installation_token,
+)
 
-import aiohttp
-from gidgethub.aiohttp import GitHubAPI
-
-@pytest.mark.asyncio
-async def test_get_user_info():
+@pytest.mark.asyncio(loop_scope="session")
+async def test_get_user_info(gh_service):
     """
     Tests the GithubService to ensure it can be created and used
     
     Note: This is an integration test and requires a valid GITHUB_TOKEN.
     """
-    token = os.getenv("GITHUB_TOKEN")
-    if not token:
-        pytest.skip("GITHUB_TOKEN is not set, skipping integration test.")
+    assert gh_service.gh is not None
+    user_info = await gh_service.get_user_info()
+    logger.info(user_info)
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_make_comment_to_pr(gh_service):
+    """
+    Tests the GithubService to ensure it can make a comment to a pr
+    """
+    assert gh_service.gh is not None
+    comment = await gh_service.post_general_pr_comment(owner="nvd11", repo_name="Terraform-GCP-config", pr_number=1, comment_body="This is a test comment")
+    logger.info(comment)
+
+
+class _FakeResponse:
+    def __init__(self, status: int, data: dict):
+        self.status = status
+        self._data = data
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def json(self):
+        return self._data
+
+    async def text(self):
+        return str(self._data)
+
+
+class _FakeSession:
+    """
+    Stands in for aiohttp.ClientSession and counts token exchange calls.
+    """
+    def __init__(self, expires_at: str):
+        self.expires_at = expires_at
+        self.calls = 0
+
+    def post(self, url, headers=None):
+        self.calls += 1
+        return _FakeResponse(201, {"token": f"token-{self.calls}", "expires_at": self.expires_at})
+
+
+@pytest.fixture
+def private_key():
+    from cryptography.hazmat.primitives.asymmetric import rsa
+
+    # server.py loads the PEM once at startup and passes the key object around
+    return rsa.generate_private_key(public_exponent=65537, key_size=2048)
 
-    async with aiohttp.ClientSession() as session:
-        gh = GitHubAPI(session, "py-webhook-svc", oauth_token=token, base_url="https://api.github.com")
-        gh_service = GithubService(gh)
-        assert gh_service.gh is not None
-        user_info = await gh_service.get_user_info()
-        logger.info(user_info)
 
 @pytest.mark.asyncio
-async def test_make_comment_to_pr():
+async def test_installation_token_is_cached(private_key):
     """
-    Tests the GithubService to ensure it can make a comment to a pr
+    A second webhook for the same installation reuses the token until it is invalidated.
     """
-    token = os.getenv("GITHUB_TOKEN")
-    if not token:
-        pytest.skip("GITHUB_TOKEN is not set, skipping integration test.")
+    session = _FakeSession(expires_at="2999-01-01T00:00:00Z")
+    token = await create_installation_access_token(session, app_id="1", private_key=private_key, installation_id=101)
+    again = await create_installation_access_token(session, app_id="1", private_key=private_key, installation_id=101)
+    assert token == again == "token-1"
+    assert session.calls == 1
+
+    invalidate_installation_token(101)
+    token = await create_installation_access_token(session, app_id="1", private_key=private_key, installation_id=101)
+    assert token == "token-2"
+
+
+@pytest.mark.asyncio
+async def test_installation_token_near_expiry_is_refreshed(private_key):
+    session = _FakeSession(expires_at="2000-01-01T00:00:00Z")
+    await create_installation_access_token(session, app_id="1", private_key=private_key, installation_id=102)
+    await create_installation_access_token(session, app_id="1", private_key=private_key, installation_id=102)
+    assert session.calls == 2
+
+
+@pytest.mark.asyncio
+async def test_app_jwt_is_reused(private_key):
+    first = await get_app_jwt("2", private_key)
+    second = await get_app_jwt("2", private_key)
+    assert first == second
+
+
+@pytest.mark.asyncio
+async def test_throttled_github_api_retries_rate_limited_calls():
+    """
+    A 429 with Retry-After is retried after the advertised delay, then the real response is returned.
+    """
+    import asyncio
+    import httpx
+
+    responses = [
+        httpx.Response(429, headers={"retry-after": "0"}, json={"message": "secondary rate limit"}),
+        httpx.Response(200, json={"login": "nvd11"}),
+    ]
+
+    def handler(request):
+        return responses.pop(0)
+
+    async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+        gh = ThrottledGitHubAPI(client, "py-webhook-svc", oauth_token="dummy", semaphore=asyncio.Semaphore(1))
+        user = await GithubService(gh).get_user_info()
+
+    assert user == {"login": "nvd11"}
+    assert responses == []
+
+
+@pytest.mark.asyncio
+async def test_throttled_github_api_retries_only_the_rejected_call_with_a_fresh_token():
+    """
+    A 401 asks for a new token and resends just that call; later calls keep the new token.
+    """
+    import asyncio
+    import httpx
+
+    seen = []
+
+    def handler(request):
+        seen.append(request.headers["authorization"])
+        if request.headers["authorization"] == "token expired":
+            return httpx.Response(401, json={"message": "Bad credentials"})
+        return httpx.Response(200, json={"login": "nvd11"})
+
+    async def refresh_token(rejected):
+        assert rejected == "expired"
+        return "fresh"
+
+    async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+        gh = ThrottledGitHubAPI(
+            client, "py-webhook-svc", oauth_token="expired", semaphore=asyncio.Semaphore(1), refresh_token=refresh_token
+        )
+        service = GithubService(gh)
+        assert await service.get_user_info() == {"login": "nvd11"}
+        assert await service.get_user_info() == {"login": "nvd11"}
+
+    assert seen == ["token expired", "token fresh", "token fresh"]
+
+
+@pytest.mark.asyncio
+async def test_throttled_github_api_does_not_wait_for_a_distant_rate_limit_reset():
+    """
+    An exhausted primary rate limit that resets minutes from now is raised right away instead of retried.
+    """
+    import asyncio
+    import time
+    import httpx
+    from gidgethub import BadRequest
+
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        reset = str(int(time.time()) + 600)
+        return httpx.Response(
+            403,
+            headers={"x-ratelimit-limit": "5000", "x-ratelimit-remaining": "0", "x-ratelimit-reset": reset},
+            json={"message": "API rate limit exceeded"},
+        )
+
+    async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+        gh = ThrottledGitHubAPI(client, "py-webhook-svc", oauth_token="dummy", semaphore=asyncio.Semaphore(1))
+        # gidgethub raises BadRequest (RateLimitExceeded is a subclass) for the 403
+        with pytest.raises(BadRequest) as exc_info:
+            await GithubService(gh).get_user_info()
 
-    async with aiohttp.ClientSession() as session:
-        gh = GitHubAPI(session, "py-webhook-svc", oauth_token=token, base_url="https://api.github.com")
-        gh_service = GithubService(gh)
-        assert gh_service.gh is not None
-        comment = await gh_service.post_general_pr_comment(owner="nvd11", repo_name="Terraform-GCP-config", pr_number=1, comment_body="This is a test comment")
-        logger.info(comment)
+    assert exc_info.value.status_code == 403
+    assert len(calls) == 1
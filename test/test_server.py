@@ -0,0 +1,179 @@
+import src.configs.config
+
+import asyncio
+import hashlib
+import hmac
+
+import pytest
+from fastapi.testclient import TestClient
+from gidgethub import sansio
+
+import server
+
+SECRET = "test-secret"
+BODY = b'{"zen": "Keep it logically awesome.", "hook_id": 1}'
+
+
+def _headers(**extra) -> dict:
+    return {
+        "content-type": "application/json",
+        "x-github-event": "ping",
+        "x-github-delivery": "delivery-1",
+        **extra,
+    }
+
+
+def _sign(body: bytes, secret: str = SECRET) -> str:
+    return "sha256=" + hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+
+
+@pytest.fixture
+def client(monkeypatch):
+    """
+    TestClient with the webhook secret configured and no App credentials,
+    so accepted events stop before reaching GitHub.
+    """
+    monkeypatch.setenv("GITHUB_WEBHOOK_SECRET", SECRET)
+    monkeypatch.setattr(server, "APP_ID", None)
+    with TestClient(server.app) as c:
+        yield c
+
+
+def test_webhook_valid_signature(client):
+    resp = client.post("/webhook", content=BODY, headers=_headers(**{"x-hub-signature-256": _sign(BODY)}))
+    assert resp.status_code == 202
+
+
+def test_webhook_legacy_sha1_signature(client):
+    sig = "sha1=" + hmac.new(SECRET.encode(), BODY, hashlib.sha1).hexdigest()
+    resp = client.post("/webhook", content=BODY, headers=_headers(**{"x-hub-signature": sig}))
+    assert resp.status_code == 202
+
+
+def test_webhook_wrong_signature(client):
+    resp = client.post("/webhook", content=BODY, headers=_headers(**{"x-hub-signature-256": _sign(BODY, "other")}))
+    assert resp.status_code == 401
+
+
+def test_webhook_missing_signature(client):
+    resp = client.post("/webhook", content=BODY, headers=_headers())
+    assert resp.status_code == 401
+
+
+def test_webhook_non_ascii_signature(client):
+    headers = [(k.encode(), v.encode()) for k, v in _headers().items()]
+    headers.append((b"x-hub-signature-256", "sha256=é".encode("latin-1")))
+    resp = client.post("/webhook", content=BODY, headers=headers)
+    assert resp.status_code == 401
+
+
+def test_webhook_signed_without_secret(client, monkeypatch):
+    monkeypatch.delenv("GITHUB_WEBHOOK_SECRET")
+    resp = client.post("/webhook", content=BODY, headers=_headers(**{"x-hub-signature-256": _sign(BODY)}))
+    assert resp.status_code == 401
+
+
+class _FakeRedis:
+    """
+    Just the SET NX / DELETE subset of redis.asyncio.Redis used for delivery dedupe.
+    """
+    def __init__(self):
+        self.store = {}
+
+    async def set(self, key, value, ex=None, nx=False):
+        if nx and key in self.store:
+            return None
+        self.store[key] = value
+        return True
+
+    async def delete(self, key):
+        self.store.pop(key, None)
+
+    async def aclose(self):
+        pass
+
+
+class _DownRedis(_FakeRedis):
+    async def set(self, *args, **kwargs):
+        raise ConnectionError("redis is down")
+
+    async def delete(self, *args, **kwargs):
+        raise ConnectionError("redis is down")
+
+
+def _post_signed(client, delivery_id="delivery-1"):
+    headers = _headers(**{"x-hub-signature-256": _sign(BODY), "x-github-delivery": delivery_id})
+    return client.post("/webhook", content=BODY, headers=headers)
+
+
+class _Handler:
+    """
+    Stands in for server.handle_webhook_event and records the delivery ids it was called with.
+    """
+    def __init__(self):
+        self.calls = []
+        self.ok = True
+
+    async def __call__(self, event):
+        self.calls.append(event.delivery_id)
+        return self.ok
+
+
+@pytest.fixture
+def handler(monkeypatch):
+    handler = _Handler()
+    monkeypatch.setattr(server, "handle_webhook_event", handler)
+    return handler
+
+
+def test_duplicate_delivery_is_processed_once(client, handler):
+    client.app.state.redis = _FakeRedis()
+    assert _post_signed(client).status_code == 202
+    assert _post_signed(client).status_code == 202
+    assert handler.calls == ["delivery-1"]
+
+
+def test_failed_delivery_can_be_redelivered(client, handler):
+    client.app.state.redis = redis = _FakeRedis()
+    handler.ok = False
+    _post_signed(client)
+    assert redis.store == {}
+
+    handler.ok = True
+    _post_signed(client)
+    assert handler.calls == ["delivery-1", "delivery-1"]
+    assert "gh:delivery:delivery-1" in redis.store
+
+
+def test_delivery_is_processed_when_redis_is_down(client, handler):
+    client.app.state.redis = _DownRedis()
+    handler.ok = False
+    assert _post_signed(client).status_code == 202
+    assert _post_signed(client).status_code == 202
+    assert handler.calls == ["delivery-1", "delivery-1"]
+
+
+@pytest.mark.asyncio
+async def test_cancelled_delivery_is_released(monkeypatch):
+    """
+    A handler cancelled mid-way (arq job timeout, shutdown) still frees the id for a redelivery.
+    """
+    started = asyncio.Event()
+
+    async def slow_handle(event):
+        started.set()
+        await asyncio.sleep(3600)
+        return True
+
+    redis = _FakeRedis()
+    redis.store["gh:delivery:delivery-1"] = 1
+    monkeypatch.setattr(server.app.state, "redis", redis, raising=False)
+    monkeypatch.setattr(server, "handle_webhook_event", slow_handle)
+
+    event = sansio.Event({}, event="ping", delivery_id="delivery-1")
+    task = asyncio.create_task(server.process_webhook_event(event))
+    await started.wait()
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+    assert redis.store == {}